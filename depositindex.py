@@ -0,0 +1,142 @@
+"""
+Index over (uid on the ring, deposit_per_channel) for deposit aware channel
+partner selection.
+
+Nodes are sorted by deposit and split into leaves of leaf_size nodes, on top
+of which a tree of ranges of leaves is built (merge sort tree), every range
+holding the uids of its nodes sorted. A query for the nodes closest to a
+target id with a deposit in [lo, hi] bisects the deposits, covers the band
+with at most two ranges per level and merges their walks along the ring.
+Only the at most two leaves clipped by the band are walked with a filter on
+the deposit, so the first result costs O(log(n)**2 + leaf_size) instead of
+a walk over all nodes as with ChannelNetwork.get_closest_node_ids, at the
+price of storing every uid once per level.
+"""
+import bisect
+import heapq
+import itertools
+import time
+from array import array
+from netbuild import ring_order
+from routing_sim import Node
+
+
+class DepositIndex(object):
+
+    def __init__(self, nodes, max_id, leaf_size=64):
+        self.max_id = max_id
+        self.leaf_size = leaf_size
+        entries = sorted((node.deposit_per_channel, node.uid) for node in nodes)
+        self.deposits = [d for d, uid in entries]
+        self.leaves = []  # [(sorted uids, deposits), ...] in deposit order
+        for k in range(0, len(entries), leaf_size):
+            leaf = sorted((uid, d) for d, uid in entries[k:k + leaf_size])
+            self.leaves.append((array('L', [uid for uid, d in leaf]), [d for uid, d in leaf]))
+        # levels[l][i]: sorted uids of leaves [i * 2**l, (i + 1) * 2**l)
+        self.levels = [[uids for uids, deposits in self.leaves]]
+        while len(self.levels[-1]) > 1:
+            below = self.levels[-1]
+            self.levels.append([array('L', heapq.merge(*below[i:i + 2]))
+                                for i in range(0, len(below), 2)])
+
+    def _walk(self, uids, target_id):
+        for d, i in ring_order(uids, target_id, self.max_id):
+            yield d, uids[i]
+
+    def _walk_leaf(self, leaf, target_id, lo, hi):
+        uids, deposits = self.leaves[leaf]
+        for d, i in ring_order(uids, target_id, self.max_id):
+            if lo <= deposits[i] <= hi:
+                yield d, uids[i]
+
+    def nearest(self, target_id, lo, hi):
+        "generator of uids with lo <= deposit <= hi, closest to target_id first"
+        size = self.leaf_size
+        start = bisect.bisect_left(self.deposits, lo)
+        end = bisect.bisect_right(self.deposits, hi)
+        walks = []
+        if start < end:
+            # leaves [a, b) are completely within the band
+            a = -(-start // size)
+            b = len(self.leaves) if end == len(self.deposits) else end // size
+            if a >= b:
+                for leaf in sorted(set([start // size, (end - 1) // size])):
+                    walks.append(self._walk_leaf(leaf, target_id, lo, hi))
+            else:
+                if start < a * size:
+                    walks.append(self._walk_leaf(a - 1, target_id, lo, hi))
+                if end > b * size:
+                    walks.append(self._walk_leaf(b, target_id, lo, hi))
+                for uids in self._cover(a, b):
+                    walks.append(self._walk(uids, target_id))
+        return (uid for d, uid in heapq.merge(*walks))
+
+    def _cover(self, a, b):
+        "sorted uids of the fewest ranges of the tree covering leaves [a, b)"
+        for level in self.levels:
+            if a >= b:
+                break
+            if a & 1:
+                yield level[a]
+                a += 1
+            if b & 1:
+                b -= 1
+                yield level[b]
+            a >>= 1
+            b >>= 1
+
+
+def connect_nodes_by_deposit(cn, similarity=1.5, index=None):
+    """
+    like ChannelNetwork.connect_nodes, but per target first tries the closest
+    nodes with a deposit within a factor of similarity of the own deposit and
+    only then any node both sides would accept
+    """
+    index = index or DepositIndex(cn.nodes, cn.max_id)
+    dev = Node.min_deposit_deviation
+    for node in cn.nodes:
+        deposit = node.deposit_per_channel
+        partners = set(cv.partner for cv in node.channels)
+        for target_id in node.targets:
+            candidates = itertools.chain(
+                index.nearest(target_id, deposit / similarity, deposit * similarity),
+                index.nearest(target_id, deposit * dev, deposit / dev))
+            for uid in candidates:
+                if uid == node.uid or uid in partners:
+                    continue
+                other = cn.node_by_id[uid]
+                if other.connect_requested(node) and node.connect_requested(other):
+                    cn.add_edge(node, other)
+                    node.setup_channel(other)
+                    other.setup_channel(node)
+                    partners.add(uid)
+                    break
+    cn.remove_unconnected()
+
+
+def deposit_similarity(cn):
+    "median ratio of the larger to the smaller deposit over all channels"
+    ratios = sorted(max(a.deposit_per_channel, b.deposit_per_channel) /
+                    float(min(a.deposit_per_channel, b.deposit_per_channel))
+                    for a, b in cn.G.edges())
+    return ratios[len(ratios) // 2] if ratios else None
+
+
+def test_deposit_aware_network(config, similarity=1.5):
+    from routing_sim import ChannelNetwork
+    from netbuild import build_network
+    start = time.time()
+    cn = build_network(config, processes=1)
+    print "default: {:.1f}s median deposit ratio {:.2f}".format(
+        time.time() - start, deposit_similarity(cn))
+    start = time.time()
+    cn = ChannelNetwork()
+    cn.generate_nodes(config)
+    connect_nodes_by_deposit(cn, similarity)
+    print "deposit aware: {:.1f}s median deposit ratio {:.2f}".format(
+        time.time() - start, deposit_similarity(cn))
+
+
+if __name__ == '__main__':
+    from routing_sim import BaseNetworkConfiguration
+    test_deposit_aware_network(BaseNetworkConfiguration(10000))
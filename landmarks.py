@@ -0,0 +1,174 @@
+"""
+Landmark (ALT) guided global path finding.
+
+k landmark nodes spread evenly over the id ring. Hop distances from and to
+every landmark are computed once on the full channel graph. Since channels
+filtered by capacity only remove edges, the triangle inequality bounds
+
+    d(v, t) >= d(L, t) - d(L, v)
+    d(v, t) >= d(v, L) - d(t, L)
+
+stay valid for any transfer value and guide an A* search, which returns
+paths of the same length as dijkstra_path while expanding far fewer nodes.
+Distances are kept per landmark in compact 16 bit arrays. Balances may change
+between queries, the topology may not.
+"""
+import bisect
+import heapq
+import random
+import time
+from array import array
+from netstats import CompactGraph, channel_capacity, multi_source_bfs
+
+UNREACHABLE = 0xFFFF
+
+
+def _distances(graph, sources):
+    "[array of hop distances per node idx for each of sources]"
+    dists = [array('H', [UNREACHABLE]) * len(graph) for _ in sources]
+    for i, idx in enumerate(sources):
+        dists[i][idx] = 0
+    for hops, frontier in multi_source_bfs(graph, sources):
+        for v, bits in frontier.iteritems():
+            while bits:
+                low = bits & -bits
+                dists[low.bit_length() - 1][v] = hops
+                bits ^= low
+    return dists
+
+
+class LandmarkRouter(object):
+
+    def __init__(self, cn, num_landmarks=32, num_active=8):
+        start = time.time()
+        self.cn = cn
+        self.num_active = num_active  # landmarks used per query
+        self.graph = graph = CompactGraph(cn)
+        self.out_accounts = [[cn.G.adj[a][graph.nodes[j]] for j in graph.out[i]]
+                             for i, a in enumerate(graph.nodes)]
+        uids = [node.uid for node in graph.nodes]
+        landmarks = []
+        for i in range(num_landmarks):
+            idx = bisect.bisect_left(uids, i * cn.max_id // num_landmarks) % len(uids)
+            if idx not in landmarks:
+                landmarks.append(idx)
+        self.landmarks = landmarks
+        self.dist_from = _distances(graph, landmarks)  # [landmark][v] = d(L, v)
+        self.dist_to = _distances(graph.reversed(), landmarks)  # [landmark][v] = d(v, L)
+        self.elapsed = time.time() - start
+
+    @property
+    def memory(self):
+        "bytes used by the distance arrays"
+        return sum(a.itemsize * len(a) for a in self.dist_from + self.dist_to)
+
+    def __repr__(self):
+        return '<LandmarkRouter(landmarks:{} {:.1f}MB {:.1f}s)>'.format(
+            len(self.landmarks), self.memory / 1024. ** 2, self.elapsed)
+
+    def _bounds(self, t):
+        "[(d(L, t), dist_from[L], d(t, L), dist_to[L]), ...] for landmarks reaching t"
+        bounds = []
+        for dist_from, dist_to in zip(self.dist_from, self.dist_to):
+            if dist_from[t] != UNREACHABLE and dist_to[t] != UNREACHABLE:
+                bounds.append((dist_from[t], dist_from, dist_to[t], dist_to))
+        return bounds
+
+    def _heuristic(self, bounds, v):
+        h = 0
+        for from_t, dist_from, to_t, dist_to in bounds:
+            from_v, to_v = dist_from[v], dist_to[v]
+            if from_v != UNREACHABLE and from_t - from_v > h:
+                h = from_t - from_v
+            if to_v != UNREACHABLE and to_v - to_t > h:
+                h = to_v - to_t
+        return h
+
+    def find_path_idxs(self, s, t, value, guided=True):
+        """
+        returns (path, expanded) with path as node idxs,
+        guided=False runs the same search without bounds, i.e. plain dijkstra
+        """
+        if guided:
+            bounds = self._bounds(t)
+            bounds.sort(key=lambda b: -self._heuristic([b], s))
+            bounds = bounds[:self.num_active]
+        else:
+            bounds = []
+        nodes, out, out_accounts = self.graph.nodes, self.graph.out, self.out_accounts
+        dist = {s: 0}
+        parent = {s: None}
+        queue = [(self._heuristic(bounds, s), 0, s)]
+        expanded = 0
+        while queue:
+            f, d, u = heapq.heappop(queue)
+            if d > dist[u]:  # outdated entry
+                continue
+            expanded += 1
+            if u == t:
+                path = [t]
+                while parent[path[-1]] is not None:
+                    path.append(parent[path[-1]])
+                return path[::-1], expanded
+            a = nodes[u]
+            for v, account in zip(out[u], out_accounts[u]):
+                if d + 1 < dist.get(v, UNREACHABLE) and \
+                        channel_capacity(a, nodes[v], account) >= value:
+                    dist[v] = d + 1
+                    parent[v] = u
+                    heapq.heappush(queue, (d + 1 + self._heuristic(bounds, v), d + 1, v))
+        return None, expanded
+
+    def find_path(self, source, target, value):
+        """
+        path of nodes, [] if there is none, the search is exact
+        None if source or target are not in the graph the router was built for
+        """
+        index = self.graph.index
+        if source not in index or target not in index:
+            return None
+        path, expanded = self.find_path_idxs(index[source], index[target], value)
+        if path is None:
+            return []
+        return [self.graph.nodes[i] for i in path]
+
+
+def test_landmark_routing(cn, router, num_queries=1000, value=2):
+    from dijkstra_weighted import dijkstra_path
+    import networkx as nx
+    print router
+    index = router.graph.index
+    cost_func = cn._get_path_cost_function(value)
+    expanded = plain_expanded = equal = found = 0
+    t_alt = t_global = 0.
+    for i in range(num_queries):
+        source, target = random.sample(router.graph.nodes, 2)
+        start = time.time()
+        path, e = router.find_path_idxs(index[source], index[target], value)
+        t_alt += time.time() - start
+        expanded += e
+        plain_expanded += router.find_path_idxs(index[source], index[target], value,
+                                                guided=False)[1]
+        start = time.time()
+        try:
+            exact = dijkstra_path(cn.G, source, target, cost_func)
+        except nx.NetworkXNoPath:
+            exact = None
+        t_global += time.time() - start
+        found += bool(path)
+        equal += (path is None and exact is None) or \
+            (path is not None and exact is not None and len(path) == len(exact))
+    print "found {} equal length {}/{}".format(found, equal, num_queries)
+    print "expanded avg alt:{:.1f} plain:{:.1f} ({:.1f}%)".format(
+        expanded / float(num_queries), plain_expanded / float(num_queries),
+        100. * expanded / (plain_expanded or 1))
+    print "alt {:.2f}ms global {:.2f}ms per query".format(
+        1000 * t_alt / num_queries, 1000 * t_global / num_queries)
+
+
+if __name__ == '__main__':
+    from routing_sim import BaseNetworkConfiguration
+    from netbuild import build_network
+    cn = build_network(BaseNetworkConfiguration(10000))
+    router = LandmarkRouter(cn)
+    test_landmark_routing(cn, router)
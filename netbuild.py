@@ -0,0 +1,191 @@
+"""
+Parallel, reproducible construction of a ChannelNetwork.
+
+ChannelNetwork.generate_nodes and connect_nodes draw from the global random
+stream node after node, so results depend on the order of work. Here:
+
+1. node attributes are drawn per node from its own stream derived from
+   (seed, node index), computed in chunks across a process pool
+2. channel partner candidates, i.e. nodes closest to each of a node's targets
+   that pass both sides' deposit checks, only depend on the attributes and are
+   computed in parallel as well
+3. a serial merge walks the nodes in uid order and accepts the first candidate
+   per target which is not yet a partner
+
+The network only depends on config and seed, not on the number of processes.
+"""
+import bisect
+import itertools
+import multiprocessing
+import random
+import time
+from routing_sim import ChannelNetwork, FullNode, Node, channel_targets
+
+
+def node_rng(seed, idx):
+    "independent stream per node"
+    return random.Random((seed << 40) + idx)
+
+
+def _node_attributes(args):
+    config, seed, start, end, max_id = args
+    attributes = []
+    for idx in range(start, end):
+        rng = node_rng(seed, idx)
+        uid = rng.randrange(max_id)
+        num_channels = int(config.fn_num_channel_dist.random(rng))  # drawn anyway, keeps streams
+        if config.num_channels_per_node is not None:
+            num_channels = config.num_channels_per_node
+        deposit_per_channel = int(config.fn_deposit_dist.random(rng))
+        attributes.append((uid, num_channels, deposit_per_channel))
+    return attributes
+
+
+def ring_order(ids, target_id, max_id):
+    "generator of (ring distance, idx) of the sorted ids, closest to target_id first"
+    n = len(ids)
+
+    def distance(i):
+        d = abs(ids[i] - target_id)
+        return min(d, max_id - d)
+
+    right = bisect.bisect_left(ids, target_id) % n
+    left = (right - 1) % n
+    dl, dr = distance(left), distance(right)
+    for _ in xrange(n):
+        if dl < dr:
+            yield dl, left
+            left = (left - 1) % n
+            dl = distance(left)
+        else:
+            yield dr, right
+            right = (right + 1) % n
+            dr = distance(right)
+
+
+def closest_candidates(nodeids, deposits, idx, target_id, max_id):
+    """
+    generator of node idxs ordered by ring distance to target_id,
+    which idx would request and which would accept a channel with idx
+    """
+    min_dev = Node.min_deposit_deviation
+    deposit = deposits[idx]
+    for d, i in ring_order(nodeids, target_id, max_id):
+        if i != idx and deposits[i] > min_dev * deposit and deposit >= min_dev * deposits[i]:
+            yield i
+
+
+# set per worker process, so that the node arrays are only sent once
+_worker_state = dict()
+
+
+def _init_worker(nodeids, num_channels, deposits, max_id, num_candidates):
+    _worker_state.update(nodeids=nodeids, num_channels=num_channels, deposits=deposits,
+                         max_id=max_id, num_candidates=num_candidates)
+
+
+def _channel_candidates(args):
+    start, end = args
+    s = _worker_state
+    nodeids, deposits, max_id = s['nodeids'], s['deposits'], s['max_id']
+    candidates = []
+    for idx in range(start, end):
+        per_target = []
+        for target_id in channel_targets(nodeids[idx], s['num_channels'][idx], max_id):
+            gen = closest_candidates(nodeids, deposits, idx, target_id, max_id)
+            per_target.append(list(itertools.islice(gen, s['num_candidates'])))
+        candidates.append(per_target)
+    return candidates
+
+
+def _chunks(num, processes):
+    size = max(1, num // (processes * 4) + 1)
+    return [(start, min(start + size, num)) for start in range(0, num, size)]
+
+
+def _map(pool, func, args):
+    if pool is None:
+        return map(func, args)
+    return pool.map(func, args)
+
+
+def build_network(config, seed=43, processes=None, num_candidates=8):
+    """
+    returns a connected ChannelNetwork, identical for any number of processes
+    num_candidates: closest candidates precomputed per target, more are only
+    searched (serially) if all of them are partners already
+    """
+    processes = processes or multiprocessing.cpu_count()
+    start = time.time()
+    cn = ChannelNetwork()
+    n = config.fn_num_nodes
+
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    chunks = [(config, seed, a, b, cn.max_id) for a, b in _chunks(n, processes)]
+    attributes = dict()
+    for chunk in _map(pool, _node_attributes, chunks):
+        for uid, num_channels, deposit_per_channel in chunk:
+            attributes.setdefault(uid, (num_channels, deposit_per_channel))  # first uid wins
+    if pool:
+        pool.close()
+    nodeids = sorted(attributes)
+    num_channels = [attributes[uid][0] for uid in nodeids]
+    deposits = [attributes[uid][1] for uid in nodeids]
+    print "generated {} nodes in {:.1f}s".format(len(nodeids), time.time() - start)
+
+    initargs = (nodeids, num_channels, deposits, cn.max_id, num_candidates)
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+    else:
+        _init_worker(*initargs)
+    candidates = []
+    for chunk in _map(pool, _channel_candidates, _chunks(len(nodeids), processes)):
+        candidates.extend(chunk)
+    if pool:
+        pool.close()
+    print "computed candidates in {:.1f}s".format(time.time() - start)
+
+    # merge
+    for uid, nc, deposit_per_channel in zip(nodeids, num_channels, deposits):
+        cn.node_by_id[uid] = FullNode(cn, uid, nc, deposit_per_channel)
+    cn.nodeids = list(nodeids)
+    cn.nodes = [cn.node_by_id[uid] for uid in nodeids]
+    partners = [set() for _ in nodeids]
+    for idx, node in enumerate(cn.nodes):
+        targets = channel_targets(node.uid, node.num_channels, cn.max_id)
+        for target_id, precomputed in zip(targets, candidates[idx]):
+            more = closest_candidates(nodeids, deposits, idx, target_id, cn.max_id)
+            for other_idx in itertools.chain(precomputed,
+                                             itertools.islice(more, num_candidates, None)):
+                if other_idx not in partners[idx]:
+                    other = cn.nodes[other_idx]
+                    cn.add_edge(node, other)
+                    node.setup_channel(other)
+                    other.setup_channel(node)
+                    partners[idx].add(other_idx)
+                    partners[other_idx].add(idx)
+                    break
+
+    cn.remove_unconnected()
+    print "built network in {:.1f}s".format(time.time() - start)
+    return cn
+
+
+def test_build_network_deterministic(config, seed=43, processes=(1, 4)):
+    def summary(cn):
+        nodes = [(n.uid, n.num_channels, n.deposit_per_channel) for n in cn.nodes]
+        edges = sorted(tuple(sorted((a.uid, b.uid))) for a, b in cn.G.edges())
+        return nodes, edges
+
+    first = summary(build_network(config, seed, processes[0]))
+    assert first[1]
+    for p in processes[1:]:
+        assert summary(build_network(config, seed, p)) == first
+
+
+if __name__ == '__main__':
+    import sys
+    from routing_sim import BaseNetworkConfiguration
+    test_build_network_deterministic(BaseNetworkConfiguration(1000))
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    build_network(BaseNetworkConfiguration(num_nodes))
@@ -0,0 +1,346 @@
+"""
+Bulk statistics over the ChannelNetwork graph.
+
+Nodes are mapped to consecutive indices and channels to index adjacency lists,
+so that the hot loops only touch ints. Bitsets are plain python ints with one
+bit per BFS source, which lets a single pass run many searches at once.
+"""
+import collections
+import copy
+import csv
+import random
+import time
+from array import array
+
+
+def channel_capacity(a, b, account):
+    "what a can send to b over their channel, same as in cost_func_fast"
+    if a.uid < b.uid:
+        return account['balance'] + account[a.uid]
+    return -account['balance'] + account[a.uid]
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+class CompactGraph(object):
+
+    "index based view on the channel graph, only channels with min_capacity"
+
+    def __init__(self, cn, min_capacity=0):
+        self.min_capacity = min_capacity
+        self.nodes = sorted(cn.G.nodes(), key=lambda n: n.uid)
+        self.index = dict((n, i) for i, n in enumerate(self.nodes))
+        self.channels = []  # channel idx -> (a idx, b idx) with a idx < b idx
+        self.channel_index = dict()  # (a idx, b idx) -> channel idx
+        self.out = []  # node idx -> [node idx, ...]
+        self.out_channels = []  # node idx -> [channel idx, ...] parallel to out
+        for a in self.nodes:
+            i = self.index[a]
+            out, out_channels = [], []
+            for b, account in cn.G.adj[a].items():
+                j = self.index[b]
+                key = (i, j) if i < j else (j, i)
+                if key not in self.channel_index:
+                    self.channel_index[key] = len(self.channels)
+                    self.channels.append(key)
+                if channel_capacity(a, b, account) >= min_capacity:
+                    out.append(j)
+                    out_channels.append(self.channel_index[key])
+            self.out.append(out)
+            self.out_channels.append(out_channels)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def reversed(self):
+        "copy with every usable channel direction flipped"
+        rev = copy.copy(self)
+        rev.out = [[] for _ in self.nodes]
+        rev.out_channels = [[] for _ in self.nodes]
+        for u, (outs, channels) in enumerate(zip(self.out, self.out_channels)):
+            for v, c in zip(outs, channels):
+                rev.out[v].append(u)
+                rev.out_channels[v].append(c)
+        return rev
+
+    @property
+    def num_edges(self):
+        "directed, i.e. channels usable in both directions count twice"
+        return sum(len(o) for o in self.out)
+
+
+def multi_source_bfs(graph, sources):
+    """
+    runs a BFS from every node idx in sources at once, bit i tracks sources[i]
+    yields (hops, frontier) with frontier a dict of node idx -> bitset of the
+    sources which reach that node in exactly hops
+    """
+    out = graph.out
+    visited = [0] * len(graph)
+    frontier = dict()
+    for bit, idx in enumerate(sources):
+        frontier[idx] = frontier.get(idx, 0) | (1 << bit)
+    for idx, bits in frontier.iteritems():
+        visited[idx] |= bits
+    hops = 0
+    while frontier:
+        hops += 1
+        reached = dict()
+        for u, bits in frontier.iteritems():
+            for v in out[u]:
+                reached[v] = reached.get(v, 0) | bits
+        frontier = dict()
+        for v, bits in reached.iteritems():
+            bits &= ~visited[v]
+            if bits:
+                visited[v] |= bits
+                frontier[v] = bits
+        if frontier:
+            yield hops, frontier
+
+
+class HopStats(object):
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.histogram = collections.Counter()  # hops -> num (source, target) pairs
+        self.eccentricity = dict()  # node idx -> max hops to any reachable node
+        self.num_sources = 0
+        self.unreachable = 0  # num (source, target) pairs without a path
+        self.elapsed = 0.
+
+    @property
+    def num_pairs(self):
+        return sum(self.histogram.values())
+
+    @property
+    def diameter(self):
+        return max(self.eccentricity.values()) if self.eccentricity else 0
+
+    @property
+    def radius(self):
+        "over sources reaching any node, isolated ones have an eccentricity of 0"
+        return min([e for e in self.eccentricity.values() if e] or [0])
+
+    @property
+    def mean_hops(self):
+        if not self.num_pairs:
+            return 0.
+        return sum(h * c for h, c in self.histogram.items()) / float(self.num_pairs)
+
+    def __repr__(self):
+        return '<HopStats(sources:{} pairs:{} unreachable:{} mean:{:.2f} diameter:{} ' \
+            'radius:{} {:.1f}s)>'.format(self.num_sources, self.num_pairs, self.unreachable,
+                                         self.mean_hops, self.diameter, self.radius,
+                                         self.elapsed)
+
+
+def hop_stats(cn, min_capacity=0, num_sources=None, width=1024):
+    """
+    hop distance histogram, eccentricities and diameter of the network
+    only channels able to transfer min_capacity are used.
+    num_sources: sample that many sources instead of computing all pairs
+    width: number of sources run in parallel per pass
+    """
+    start = time.time()
+    graph = CompactGraph(cn, min_capacity)
+    sources = range(len(graph))
+    if num_sources is not None and num_sources < len(sources):
+        sources = sorted(random.sample(sources, num_sources))
+    stats = HopStats(graph)
+    stats.num_sources = len(sources)
+    for i in range(0, len(sources), width):
+        batch = sources[i:i + width]
+        ecc = [0] * len(batch)
+        reached = 0
+        for hops, frontier in multi_source_bfs(graph, batch):
+            level = 0
+            num = 0
+            for bits in frontier.itervalues():
+                level |= bits
+                num += popcount(bits)
+            stats.histogram[hops] += num
+            reached += num
+            while level:  # every source seen in this level has at least hops ecc
+                low = level & -level
+                ecc[low.bit_length() - 1] = hops
+                level ^= low
+        stats.unreachable += len(batch) * (len(graph) - 1) - reached
+        for idx, e in zip(batch, ecc):
+            stats.eccentricity[idx] = e
+    stats.elapsed = time.time() - start
+    return stats
+
+
+class ChannelLoad(object):
+
+    """
+    usage counts of channels and nodes, accumulated over many paths
+    node_load only counts mediating nodes, i.e. not the source and the target
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.channel_load = array('d', [0.]) * len(graph.channels)
+        self.node_load = array('d', [0.]) * len(graph)
+        self.num_paths = 0
+
+    def add_path(self, path, weight=1):
+        index = self.graph.index
+        channel_index = self.graph.channel_index
+        idxs = [index[node] for node in path]
+        for i in range(len(idxs) - 1):
+            a, b = idxs[i:i + 2]
+            self.channel_load[channel_index[(a, b) if a < b else (b, a)]] += weight
+        for i in idxs[1:-1]:
+            self.node_load[i] += weight
+        self.num_paths += 1
+
+    def add_paths(self, paths):
+        for path in paths:
+            if path:
+                self.add_path(path)
+
+    def top_channels(self, num=10):
+        "[(load, a, b), ...]"
+        nodes = self.graph.nodes
+        loads = sorted(((l, c) for c, l in enumerate(self.channel_load) if l),
+                       reverse=True)[:num]
+        return [(l, nodes[self.graph.channels[c][0]], nodes[self.graph.channels[c][1]])
+                for l, c in loads]
+
+    def top_nodes(self, num=10):
+        "[(load, node), ...]"
+        nodes = self.graph.nodes
+        loads = sorted(((l, i) for i, l in enumerate(self.node_load) if l), reverse=True)
+        return [(l, nodes[i]) for l, i in loads[:num]]
+
+    def channel_load_by_edge(self):
+        "{(a, b): load} keyed like the edges in cn.G, e.g. for utils.draw_load"
+        nodes = self.graph.nodes
+        return dict(((nodes[i], nodes[j]), self.channel_load[c])
+                    for c, (i, j) in enumerate(self.graph.channels))
+
+    def export_csv(self, filename):
+        "rows of kind, uid, partner uid, load"
+        nodes = self.graph.nodes
+        with open(filename, 'wb') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(('kind', 'uid', 'partner', 'load'))
+            for i, l in enumerate(self.node_load):
+                writer.writerow(('node', nodes[i].uid, '', l))
+            for c, (i, j) in enumerate(self.graph.channels):
+                writer.writerow(('channel', nodes[i].uid, nodes[j].uid, self.channel_load[c]))
+
+
+def betweenness(cn, value=0, num_sources=None):
+    """
+    approximate betweenness over the shortest paths using only channels
+    with at least value capacity (Brandes, paths are only counted not built).
+    num_sources: sample that many sources and scale up the result
+    returns a ChannelLoad with the (fractional) betweenness as load
+    """
+    graph = CompactGraph(cn, min_capacity=value)
+    out, out_channels = graph.out, graph.out_channels
+    n = len(graph)
+    load = ChannelLoad(graph)
+    channel_load, node_load = load.channel_load, load.node_load
+    sources = range(n)
+    if num_sources is not None and num_sources < n:
+        sources = random.sample(sources, num_sources)
+    for s in sources:
+        dist = [-1] * n
+        sigma = [0] * n  # num shortest paths from s
+        preds = [[] for _ in range(n)]  # node idx -> [(pred idx, channel idx), ...]
+        dist[s] = 0
+        sigma[s] = 1
+        order = [s]  # bfs order, doubles as the queue
+        for v in order:
+            dv = dist[v] + 1
+            for w, c in zip(out[v], out_channels[v]):
+                if dist[w] < 0:
+                    dist[w] = dv
+                    order.append(w)
+                if dist[w] == dv:
+                    sigma[w] += sigma[v]
+                    preds[w].append((v, c))
+        delta = [0.] * n
+        for w in reversed(order):
+            coeff = (1. + delta[w]) / sigma[w]
+            for v, c in preds[w]:
+                share = sigma[v] * coeff
+                channel_load[c] += share
+                delta[v] += share
+            if w != s:
+                node_load[w] += delta[w]
+    scale = n / float(len(sources) or 1)
+    for c in range(len(channel_load)):
+        channel_load[c] *= scale
+    for i in range(n):
+        node_load[i] *= scale
+    load.num_paths = len(sources) * (n - 1)
+    return load
+
+
+def print_load(load, num=10):
+    print "top nodes"
+    for l, node in load.top_nodes(num):
+        print '{:>12.1f} {}'.format(l, node)
+    print "top channels"
+    for l, a, b in load.top_channels(num):
+        print '{:>12.1f} {} {}'.format(l, a, b)
+
+
+def test_channel_load(config, num_paths=1000, value=2, num_sources=100, recursive=False):
+    """
+    recursive: also measure the load of recursive routing,
+    which can take exponential time
+    """
+    from routing_sim import ChannelNetwork
+    cn = ChannelNetwork()
+    cn.generate_nodes(config)
+    cn.connect_nodes()
+    graph = CompactGraph(cn)
+    strategies = [('global', lambda s, t: cn.find_path_global(s, t, value))]
+    if recursive:
+        strategies.append(
+            ('recursive', lambda s, t: cn.find_path_recursively(s, t, value)[1]))
+    for name, find_path in strategies:
+        print "-" * 40
+        print name
+        load = ChannelLoad(graph)
+        for i in range(num_paths):
+            source, target = random.sample(graph.nodes, 2)
+            load.add_paths([find_path(source, target)])
+        print_load(load)
+        load.export_csv('load_{}.csv'.format(name))
+    print "-" * 40
+    print "betweenness"
+    print_load(betweenness(cn, value, num_sources))
+
+
+def print_hop_stats(stats):
+    print stats
+    total = float(stats.num_pairs + stats.unreachable) or 1.
+    for hops in sorted(stats.histogram):
+        num = stats.histogram[hops]
+        print '{:>3} hops {:>12} {:6.2f}%'.format(hops, num, 100 * num / total)
+
+
+def test_hop_stats(config, values=(0, 100, 1000)):
+    from routing_sim import ChannelNetwork
+    cn = ChannelNetwork()
+    cn.generate_nodes(config)
+    cn.connect_nodes()
+    for value in values:
+        print "-" * 40
+        print "min capacity", value
+        print_hop_stats(hop_stats(cn, min_capacity=value))
+
+
+if __name__ == '__main__':
+    from routing_sim import BaseNetworkConfiguration
+    test_hop_stats(BaseNetworkConfiguration(1000))
+    test_channel_load(BaseNetworkConfiguration(1000))
@@ -0,0 +1,119 @@
+"""
+Streaming experiment pipeline.
+
+Queries, routing and output are chained generators, so only one row is in
+flight at a time and millions of queries can be streamed to disk:
+
+    queries = random_queries(cn, 10 ** 6, value=2)
+    rows = monitor(route(cn, queries))
+    write_jsonl(rows, 'paths.jsonl')
+
+Rows are dicts with the keys in COLUMNS. write_columns stores batches of rows
+column wise instead, one json object of lists per line.
+"""
+import json
+import random
+import resource
+import time
+
+COLUMNS = ('source', 'target', 'value', 'strategy', 'hops', 'contacted', 'elapsed')
+
+
+def random_queries(cn, num, value):
+    "yields (source, target, value), value may be a callable returning values"
+    nodes = [cn.node_by_id[uid] for uid in cn.nodeids]
+    for i in xrange(num):
+        source, target = random.sample(nodes, 2)
+        yield source, target, value() if callable(value) else value
+
+
+def route(cn, queries, strategies=('global',)):
+    """
+    yields a row per query and strategy, hops is None if no path was found
+    'recursive' can take exponential time for values few channels can carry
+    """
+    for source, target, value in queries:
+        for strategy in strategies:
+            start = time.time()
+            contacted = None
+            if strategy == 'global':
+                path = cn.find_path_global(source, target, value)
+            elif strategy == 'recursive':
+                contacted, path = cn.find_path_recursively(source, target, value)
+            else:
+                raise ValueError('unknown strategy {}'.format(strategy))
+            yield dict(source=source.uid, target=target.uid, value=value, strategy=strategy,
+                       hops=len(path) - 1 if path else None, contacted=contacted,
+                       elapsed=time.time() - start)
+
+
+def peak_memory():
+    "peak resident memory of this process in MB (ru_maxrss is in KB on linux)"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def monitor(rows, every=10000):
+    "passes rows through, printing throughput and peak memory every so many rows"
+    start = last = time.time()
+    num = 0
+    for row in rows:
+        yield row
+        num += 1
+        if num % every == 0:
+            now = time.time()
+            print "rows:{} {:.0f} rows/s (total {:.0f}) peak memory {:.1f}MB".format(
+                num, every / (now - last), num / (now - start), peak_memory())
+            last = now
+
+
+def write_jsonl(rows, filename):
+    "returns the number of rows written"
+    num = 0
+    with open(filename, 'w') as fh:
+        for row in rows:
+            fh.write(json.dumps(row, separators=(',', ':')) + '\n')
+            num += 1
+    return num
+
+
+def read_jsonl(filename):
+    with open(filename) as fh:
+        for line in fh:
+            yield json.loads(line)
+
+
+def write_columns(rows, filename, batch_size=10000):
+    "returns the number of rows written"
+    num = 0
+    with open(filename, 'w') as fh:
+        batch = dict((c, []) for c in COLUMNS)
+        for row in rows:
+            for c in COLUMNS:
+                batch[c].append(row[c])
+            num += 1
+            if num % batch_size == 0:
+                fh.write(json.dumps(batch, separators=(',', ':')) + '\n')
+                batch = dict((c, []) for c in COLUMNS)
+        if num % batch_size:
+            fh.write(json.dumps(batch, separators=(',', ':')) + '\n')
+    return num
+
+
+def read_columns(filename):
+    "yields batches as dicts of column -> list"
+    with open(filename) as fh:
+        for line in fh:
+            yield json.loads(line)
+
+
+def test_streaming_pathfinding(config, num_queries=100000, value=2, filename='paths.jsonl'):
+    from netbuild import build_network
+    cn = build_network(config)
+    start = time.time()
+    num = write_jsonl(monitor(route(cn, random_queries(cn, num_queries, value))), filename)
+    print "{} rows in {:.1f}s".format(num, time.time() - start)
+
+
+if __name__ == '__main__':
+    from routing_sim import BaseNetworkConfiguration
+    test_streaming_pathfinding(BaseNetworkConfiguration(1000))
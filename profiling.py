@@ -0,0 +1,174 @@
+"""
+Opt-in profiling of the routing hot paths.
+
+Enabled by the ROUTING_SIM_PROFILE environment variable, which has to be set
+before the modules are imported, e.g.
+
+    ROUTING_SIM_PROFILE=1 python routing_sim.py         # counters only
+    ROUTING_SIM_PROFILE=cprofile python routing_sim.py  # counters and cProfile
+
+Functions decorated with @profiled are returned unchanged when disabled, so
+that there is no overhead at all. When enabled, the number of calls and the
+cumulative time per function are counted (recursive calls are timed once),
+as well as the self time per stack of profiled functions, which is written
+as collapsed stacks for flamegraph.pl or speedscope. Functions called too
+often to time them, like the dijkstra cost function, are @counted only.
+"""
+import collections
+import contextlib
+import cProfile
+import functools
+import inspect
+import os
+import time
+
+MODE = os.environ.get('ROUTING_SIM_PROFILE', '')
+ENABLED = bool(MODE)
+FRAMES_PER_CALL = 2 if ENABLED else 1  # wrappers add a frame to every call
+
+calls = collections.Counter()
+cumulative = collections.Counter()  # name -> seconds
+stack_time = collections.Counter()  # stack id -> self seconds
+_stack = []  # [[stack id, start, time spent in children], ...]
+_depth = collections.Counter()  # name -> active calls
+_stack_ids = dict()  # (parent stack id, name) -> stack id
+_stacks = []  # stack id -> (parent stack id, name), -1 is the root
+_counters = dict()  # name -> [calls not yet added to calls]
+
+
+def _enter(name):
+    calls[name] += 1
+    _depth[name] += 1
+    parent = _stack[-1][0] if _stack else -1
+    key = _stack_ids.get((parent, name))
+    if key is None:
+        key = _stack_ids[(parent, name)] = len(_stacks)
+        _stacks.append((parent, name))
+    _stack.append([key, time.time(), 0.])
+
+
+def _exit(name):
+    key, start, children = _stack.pop()
+    elapsed = time.time() - start
+    _depth[name] -= 1
+    if not _depth[name]:
+        cumulative[name] += elapsed
+    stack_time[key] += elapsed - children
+    if _stack:
+        _stack[-1][2] += elapsed
+
+
+def profiled(name):
+    """
+    decorator counting calls and time of the function under name,
+    for generators every resume counts as a call
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                gen = func(*args, **kwargs)
+                while True:
+                    _enter(name)
+                    try:
+                        value = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        _exit(name)
+                    yield value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                _enter(name)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _exit(name)
+        return wrapper
+    return decorator
+
+
+def counted(name):
+    """
+    decorator only counting calls of the function under name, for functions
+    called so often that timing them would mostly measure the timer
+    """
+    def decorator(func):
+        if not ENABLED:
+            return func
+        counter = _counters.setdefault(name, [0])
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            counter[0] += 1
+            return func(*args)
+        return wrapper
+    return decorator
+
+
+def _collect():
+    for name, counter in _counters.items():
+        calls[name] += counter[0]
+        counter[0] = 0
+
+
+def reset():
+    _collect()
+    calls.clear()
+    cumulative.clear()
+    stack_time.clear()
+
+
+def report():
+    _collect()
+    print '{:<40} {:>12} {:>10} {:>10}'.format('function', 'calls', 'total s', 'per call us')
+    for name, total in cumulative.most_common():
+        print '{:<40} {:>12} {:>10.3f} {:>10.2f}'.format(
+            name, calls[name], total, 1e6 * total / calls[name])
+    for name in sorted(_counters):
+        print '{:<40} {:>12} {:>10} {:>10}'.format(name, calls[name], '-', '-')
+
+
+def _stack_name(key, names):
+    if key not in names:
+        parent, name = _stacks[key]
+        names[key] = _stack_name(parent, names) + ';' + name if parent >= 0 else name
+    return names[key]
+
+
+def dump_collapsed(filename):
+    "one 'outer;inner microseconds' line per stack, as flamegraph.pl reads it"
+    names = dict()
+    lines = sorted((_stack_name(key, names), seconds) for key, seconds in stack_time.items())
+    with open(filename, 'w') as fh:
+        for name, seconds in lines:
+            fh.write('{} {}\n'.format(name, int(seconds * 1e6)))
+
+
+@contextlib.contextmanager
+def experiment(name):
+    """
+    profiles the block if enabled: prints the counters and writes
+    <name>.collapsed as well as <name>.prof (pstats) in cprofile mode
+    """
+    if not ENABLED:
+        yield
+        return
+    reset()
+    profile = cProfile.Profile() if MODE == 'cprofile' else None
+    if profile:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(name + '.prof')
+        print "-" * 40
+        print "profile", name
+        report()
+        dump_collapsed(name + '.collapsed')
@@ -0,0 +1,194 @@
+"""
+Circular rebalancing of depleted channels.
+
+Balances of all channels are held in arrays indexed by CompactGraph channel
+idx, the channel (i, j) always having i < j, i.e. the lower uid like the
+accounts in cn.G. For the lower uid side the capacity is balance + deposit_lo,
+for the other side deposit_hi - balance, same as ChannelView.capacity.
+
+A node whose capacity towards a partner is depleted sends funds around a
+cycle: out over its other channels, to the partner and back over the depleted
+channel. Cycles (and payments) are searched on a snapshot of the capacities
+and then applied as one batch of vectorized balance updates, dropping the
+transfers that send over a channel overdrawn by others in the same batch.
+Only the updates are vectorized, routing is a python BFS per payment and
+cycle and takes about 95% of the time of a step.
+"""
+import random
+import time
+import numpy as np
+from netstats import CompactGraph
+
+
+class ChannelBalances(object):
+
+    def __init__(self, cn, graph=None):
+        self.cn = cn
+        self.graph = graph = graph or CompactGraph(cn)
+        nodes = graph.nodes
+        self.accounts = [cn.G.adj[nodes[i]][nodes[j]] for i, j in graph.channels]
+        self.balance = np.array([a['balance'] for a in self.accounts], dtype=float)
+        self.deposit_lo = np.array([a[nodes[i].uid] for a, (i, j) in
+                                    zip(self.accounts, graph.channels)], dtype=float)
+        self.deposit_hi = np.array([a[nodes[j].uid] for a, (i, j) in
+                                    zip(self.accounts, graph.channels)], dtype=float)
+
+    @property
+    def capacity_lo(self):
+        "what the lower uid side can send"
+        return self.balance + self.deposit_lo
+
+    @property
+    def capacity_hi(self):
+        return self.deposit_hi - self.balance
+
+    def snapshot(self):
+        "capacities as lists, fast to index from python"
+        return self.capacity_lo.tolist(), self.capacity_hi.tolist()
+
+    def depleted(self, threshold=0.1):
+        """
+        [(channel idx, sender lower uid side), ...] with capacities below
+        threshold of the channel's total deposits, most depleted first
+        """
+        total = self.deposit_lo + self.deposit_hi
+        ratio_lo = self.capacity_lo / total
+        ratio_hi = self.capacity_hi / total
+        lo = np.flatnonzero(ratio_lo < threshold)
+        hi = np.flatnonzero(ratio_hi < threshold)
+        ratios = np.concatenate((ratio_lo[lo], ratio_hi[hi]))
+        channels = np.concatenate((lo, hi))
+        is_lo = np.concatenate((np.ones(len(lo), bool), np.zeros(len(hi), bool)))
+        order = np.argsort(ratios, kind='mergesort')
+        return zip(channels[order].tolist(), is_lo[order].tolist())
+
+    def apply(self, transfers):
+        """
+        transfers: [(path of node idxs, amount), ...]
+        applies all transfers which fit into the channels at once
+        returns a list of bools, whether each transfer was applied
+        """
+        if not transfers:
+            return []
+        out, out_channels = self.graph.out, self.graph.out_channels
+        hop_channels, hop_amounts, hop_transfers = [], [], []
+        for t, (path, amount) in enumerate(transfers):
+            for u, v in zip(path, path[1:]):
+                hop_channels.append(out_channels[u][out[u].index(v)])
+                hop_amounts.append(-amount if u < v else amount)  # sign by sender side
+                hop_transfers.append(t)
+        hop_channels = np.array(hop_channels)
+        hop_amounts = np.array(hop_amounts, dtype=float)
+        hop_transfers = np.array(hop_transfers)
+        applied = np.ones(len(transfers), bool)
+        while True:
+            active = applied[hop_transfers]
+            delta = np.bincount(hop_channels[active], weights=hop_amounts[active],
+                                minlength=len(self.balance))
+            balance = self.balance + delta
+            # only drop hops sending in the overdrawn direction, others relieve the channel
+            over_lo = (balance + self.deposit_lo < 0)[hop_channels] & (hop_amounts < 0)
+            over_hi = (self.deposit_hi - balance < 0)[hop_channels] & (hop_amounts > 0)
+            drop = active & (over_lo | over_hi)
+            if not drop.any():
+                break
+            applied[hop_transfers[drop]] = False
+        self.balance = balance
+        return applied.tolist()
+
+    def write_back(self):
+        "update the balances of the accounts in cn.G, i.e. what ChannelView sees"
+        for account, balance in zip(self.accounts, self.balance.tolist()):
+            account['balance'] = balance
+
+
+def find_path(graph, capacities, s, t, amount, max_hops=None, skip_channel=None):
+    "shortest path of node idxs from s to t with at least amount capacity"
+    cap_lo, cap_hi = capacities
+    out, out_channels = graph.out, graph.out_channels
+    parent = {s: None}
+    frontier = [s]
+    hops = 0
+    while frontier and (max_hops is None or hops < max_hops):
+        hops += 1
+        reached = []
+        for u in frontier:
+            for v, c in zip(out[u], out_channels[u]):
+                if v in parent or c == skip_channel:
+                    continue
+                if (cap_lo[c] if u < v else cap_hi[c]) < amount:
+                    continue
+                parent[v] = u
+                if v == t:
+                    path = [t]
+                    while parent[path[-1]] is not None:
+                        path.append(parent[path[-1]])
+                    return path[::-1]
+                reached.append(v)
+        frontier = reached
+    return None
+
+
+def find_cycles(balances, threshold=0.1, max_hops=6, max_cycles=100):
+    """
+    [(cycle of node idxs, amount), ...] rebalancing the most depleted channels
+    half way to equal capacities on both sides
+    """
+    graph = balances.graph
+    capacities = cap_lo, cap_hi = balances.snapshot()
+    cycles = []
+    for c, sender_lo in balances.depleted(threshold)[:max_cycles]:
+        i, j = graph.channels[c]
+        u, v = (i, j) if sender_lo else (j, i)  # u can hardly send to v
+        amount = abs(cap_hi[c] - cap_lo[c]) / 2.
+        path = find_path(graph, capacities, u, v, amount, max_hops - 1, skip_channel=c)
+        if path:
+            cycles.append((path + [u], amount))
+    return cycles
+
+
+def simulate(cn, num_steps=1000, payments_per_step=100, value=100, rebalance=True,
+             threshold=0.1, max_hops=6, max_cycles=100, report_every=100):
+    """
+    random payments of value, each step routed on a snapshot of the balances
+    and applied as a batch, followed by a batch of rebalancing cycles
+    returns [(step, payment success rate, rebalanced, depleted), ...] per report
+    at 1000 nodes and 100 payments a step takes about 30ms, 40ms with rebalancing
+    """
+    balances = ChannelBalances(cn)
+    graph = balances.graph
+    history = []
+    succeeded = attempted = rebalanced = 0
+    start = time.time()
+    for step in range(1, num_steps + 1):
+        capacities = balances.snapshot()
+        payments = []
+        for i in range(payments_per_step):
+            s, t = random.sample(xrange(len(graph)), 2)
+            path = find_path(graph, capacities, s, t, value)
+            if path:
+                payments.append((path, value))
+        succeeded += sum(balances.apply(payments))
+        attempted += payments_per_step
+        if rebalance:
+            cycles = find_cycles(balances, threshold, max_hops, max_cycles)
+            rebalanced += sum(balances.apply(cycles))
+        if step % report_every == 0:
+            depleted = len(balances.depleted(threshold))
+            history.append((step, succeeded / float(attempted), rebalanced, depleted))
+            print "step:{} success:{:.3f} rebalanced:{} depleted:{} {:.1f}s".format(
+                step, succeeded / float(attempted), rebalanced, depleted, time.time() - start)
+            succeeded = attempted = rebalanced = 0
+    balances.write_back()
+    return history
+
+
+if __name__ == '__main__':
+    from routing_sim import BaseNetworkConfiguration
+    from netbuild import build_network
+    config = BaseNetworkConfiguration(1000)
+    for rebalance in (False, True):
+        print "-" * 40
+        print "rebalance", rebalance
+        random.seed(43)
+        simulate(build_network(config), rebalance=rebalance)
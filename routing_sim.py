@@ -42,10 +42,20 @@ from dijkstra_weighted import dijkstra_path
 import random
 import sys
 from utils import WeightedDistribution, draw3d, export_obj
+import profiling
+from profiling import counted, profiled
 
 
 random.seed(43)
-sys.setrecursionlimit(100)
+sys.setrecursionlimit(100 * profiling.FRAMES_PER_CALL)
+
+
+def channel_targets(uid, num_channels, max_id):
+    """
+    geometrical distances with 1/3 of id space as max distance
+    """
+    distances = [2 * max_id / 2**i / 3 for i in range(1, num_channels + 1)]
+    return [(uid + d) % max_id for d in distances]
 
 
 class ChannelView(object):
@@ -124,12 +134,7 @@ class Node(object):
 
     @property
     def targets(self):
-        """
-        geometrical distances with 1/3 of id space as max distance
-        """
-        distances = [2 * self.cn.max_id / 2**i / 3
-                     for i in range(1, self.num_channels + 1)]
-        return [(self.uid + d) % self.cn.max_id for d in distances]
+        return channel_targets(self.uid, self.num_channels, self.cn.max_id)
 
     def initiate_channels(self):
         def node_filter(node):
@@ -166,6 +171,7 @@ class Node(object):
             return
         return True
 
+    @profiled('Node._channels_by_distance')
     def _channels_by_distance(self, target_id, value):
 
         max_id = self.cn.max_id
@@ -181,6 +187,7 @@ class Node(object):
         assert len(cvs) < 2 or _distance(cvs[0]) <= _distance(cvs[-1])
         return [cv for cv in cvs if cv.capacity >= value]
 
+    @profiled('Node.find_path_recursively')
     def find_path_recursively(self, target_id, value, max_hops=50, visited=[]):
         """
         sort channels by distance to target, filter by capacity
@@ -218,6 +225,9 @@ class ChannelNetwork(object):
     max_id = 2**32
     # max_id = 100
     num_channels_per_node = 5  # outgoing
+    # optional precomputed router, see find_path_global
+    # shards.ShardRouter paths are not shortest, don't install it to measure path lengths
+    router = None
 
     def __init__(self):
         self.G = nx.Graph()
@@ -230,6 +240,8 @@ class ChannelNetwork(object):
         for i in range(config.fn_num_nodes):
             uid = random.randrange(self.max_id)
             num_channels = int(config.fn_num_channel_dist.random())
+            if config.num_channels_per_node is not None:
+                num_channels = config.num_channels_per_node
             deposit_per_channel = int(config.fn_deposit_dist.random())
             node = FullNode(self, uid, num_channels, deposit_per_channel)
             self.node_by_id[uid] = node
@@ -238,14 +250,30 @@ class ChannelNetwork(object):
         self.nodes = [self.node_by_id[_uid] for _uid in self.nodeids]
 
     def connect_nodes(self):
-        for node in self.nodes[:]:
+        for node in self.nodes:
             node.initiate_channels()
-            if not node.channels:
-                print "not connected", node
+            if self._drop_unconnected(node):  # later nodes must not pick it as partner
                 self.nodeids.remove(node.uid)
-                del self.node_by_id[node.uid]
-            elif len(node.channels) < 2:
-                print "weakly connected", node
+        self._rebuild_nodes()
+
+    def remove_unconnected(self):
+        "for strategies connecting all nodes first"
+        for node in self.nodes:
+            self._drop_unconnected(node)
+        self._rebuild_nodes()
+
+    def _drop_unconnected(self, node):
+        if not node.channels:
+            print "not connected", node
+            del self.node_by_id[node.uid]
+            return True
+        elif len(node.channels) < 2:
+            print "weakly connected", node
+        return False
+
+    def _rebuild_nodes(self):
+        self.nodeids = [uid for uid in self.nodeids if uid in self.node_by_id]
+        self.nodes = [self.node_by_id[uid] for uid in self.nodeids]
 
     def add_edge(self, A, B):
         assert isinstance(A, Node)
@@ -279,6 +307,7 @@ class ChannelNetwork(object):
         #            target_id) <= abs(self._get_closest_node_id(target_id) - target_id)
         return nodeids[idx]
 
+    @profiled('ChannelNetwork.get_closest_node_ids')
     def get_closest_node_ids(self, target_id, filter=None):
         "generator"
         cid = self.get_closest_node_id(target_id, filter)
@@ -316,17 +345,23 @@ class ChannelNetwork(object):
             if capacity < value:
                 return None
             return hop_cost
-        return cost_func_fast
+        return counted('cost_func_fast')(cost_func_fast)
 
+    @profiled('ChannelNetwork.find_path_global')
     def find_path_global(self, source, target, value):
         assert isinstance(source, Node)
         assert isinstance(target, Node)
+        if self.router:  # falls back to dijkstra if it returns None, [] means there is no path
+            path = self.router.find_path(source, target, value)
+            if path is not None:
+                return path or None
         try:
             path = dijkstra_path(self.G, source, target, self._get_path_cost_function(value))
             return path
         except nx.NetworkXNoPath:
             return None
 
+    @profiled('ChannelNetwork.find_path_recursively')
     def find_path_recursively(self, source, target, value):
         assert isinstance(source, Node)
         assert isinstance(target, Node)
@@ -400,6 +435,7 @@ class BaseNetworkConfiguration(object):
 
     fn_deposit_dist.smoothen(10)
     fn_num_channel_dist = WeightedDistribution(5, weighted_values=[(10, 100)])
+    num_channels_per_node = None  # if set, overrides fn_num_channel_dist
     # light clients
     lc_num_nodes = 10 * fn_num_nodes
     lc_deposit_dist = WeightedDistribution(1, weighted_values=[(10, 90), (100, 10)])
@@ -414,4 +450,5 @@ class BaseNetworkConfiguration(object):
 if __name__ == '__main__':
     test_basic_channel()
     # test_basic_network()
-    test_global_pathfinding(BaseNetworkConfiguration(1000), num_paths=5, value=2)
+    with profiling.experiment('global_pathfinding'):
+        test_global_pathfinding(BaseNetworkConfiguration(1000), num_paths=5, value=2)
@@ -0,0 +1,274 @@
+"""
+Hierarchical routing over contiguous shards of the id space (huddles).
+
+The ring is cut into num_shards equally sized id ranges. Per shard we
+precompute (optionally in a process pool, shards are independent):
+
+- next hop tables for all pairs of nodes within the shard
+- per neighbouring shard, the next hop towards the closest gateway, i.e. a
+  node with a channel into that shard
+
+The shards and the channels between them form a small boundary graph. A
+query first finds the shortest sequence of shards, then walks the tables:
+towards the gateway into the next shard, across, and finally to the target
+within its shard. If the tables can not complete the walk (shards need not be
+connected internally), a BFS restricted to the shards on the route is used.
+
+Tables are built for channels with at least min_capacity and assume a static
+topology and balances. Paths are not shortest paths: they follow the shortest
+sequence of shards and the closest gateways, measured stretch is around 1.5.
+"""
+import bisect
+import collections
+import multiprocessing
+import random
+import time
+from array import array
+from netstats import CompactGraph
+
+UNREACHABLE = 0xFFFF
+GATEWAY = -1
+
+
+def _shard_tables(args):
+    """
+    local_out: local idx -> [local idx, ...] of channels within the shard
+    gateways: neighbour shard -> {local idx: global idx in neighbour shard}
+    """
+    local_out, gateways = args
+    s = len(local_out)
+    next_hop = array('H', [UNREACHABLE]) * (s * s)  # [u * s + v] -> next local idx
+    for u in range(s):
+        row = u * s
+        next_hop[row + u] = u
+        first = dict((w, w) for w in local_out[u])  # reached node -> first hop
+        order = list(first)
+        for w in order:
+            next_hop[row + w] = first[w]
+            for x in local_out[w]:
+                if x != u and x not in first:
+                    first[x] = first[w]
+                    order.append(x)
+
+    local_in = [[] for _ in range(s)]
+    for u, outs in enumerate(local_out):
+        for w in outs:
+            local_in[w].append(u)
+    exits = dict()
+    for shard, gws in gateways.items():
+        next_exit = array('i', [-2]) * s  # next local idx, GATEWAY or -2 if unreachable
+        order = sorted(gws)
+        for g in order:
+            next_exit[g] = GATEWAY
+        for w in order:
+            for u in local_in[w]:
+                if next_exit[u] == -2:
+                    next_exit[u] = w
+                    order.append(u)
+        exits[shard] = next_exit
+    return next_hop, exits
+
+
+class ShardRouter(object):
+
+    def __init__(self, cn, num_shards=None, min_capacity=0, processes=1):
+        start = time.time()
+        self.cn = cn
+        self.min_capacity = min_capacity
+        self.graph = graph = CompactGraph(cn, min_capacity)
+        n = len(graph)
+        self.num_shards = num_shards = num_shards or max(1, n // 256)
+        self.shard_of = array('i', [self.shard_by_id(node.uid) for node in graph.nodes])
+        # nodes are sorted by uid, so shards are contiguous idx ranges
+        self.shard_start = array('i', [bisect.bisect_left(self.shard_of, shard)
+                                       for shard in range(num_shards + 1)])
+        max_size = max(b - a for a, b in zip(self.shard_start, self.shard_start[1:]))
+        assert max_size < UNREACHABLE, 'shard of {} nodes, use more shards'.format(max_size)
+
+        args = []
+        self.gateways = []  # shard -> {neighbour shard: {local idx: global idx}}
+        for shard in range(num_shards):
+            first, end = self.shard_start[shard], self.shard_start[shard + 1]
+            local_out = []
+            gateways = collections.defaultdict(dict)
+            for idx in range(first, end):
+                local_out.append([j - first for j in graph.out[idx] if first <= j < end])
+                for j in graph.out[idx]:
+                    other = self.shard_of[j]
+                    if other != shard:
+                        gateways[other].setdefault(idx - first, j)
+            self.gateways.append(dict(gateways))
+            args.append((local_out, self.gateways[-1]))
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            tables = pool.map(_shard_tables, args)
+            pool.close()
+        else:
+            tables = map(_shard_tables, args)
+        self.next_hop = [t[0] for t in tables]
+        self.next_exit = [t[1] for t in tables]
+        self.elapsed = time.time() - start
+
+    def shard_by_id(self, uid):
+        return uid * self.num_shards // self.cn.max_id
+
+    @property
+    def memory(self):
+        "bytes used by the routing tables"
+        size = 0
+        for next_hop, exits in zip(self.next_hop, self.next_exit):
+            size += next_hop.itemsize * len(next_hop)
+            size += sum(a.itemsize * len(a) for a in exits.values())
+        return size
+
+    def __repr__(self):
+        return '<ShardRouter(shards:{} min_capacity:{} {:.1f}MB {:.1f}s)>'.format(
+            self.num_shards, self.min_capacity, self.memory / 1024. ** 2, self.elapsed)
+
+    def shard_route(self, a, b):
+        "shortest sequence of shards from a to b on the boundary graph"
+        parent = {a: None}
+        order = [a]
+        for x in order:
+            if x == b:
+                break
+            for y in self.gateways[x]:
+                if y not in parent:
+                    parent[y] = x
+                    order.append(y)
+        if b not in parent:
+            return []
+        route = [b]
+        while parent[route[-1]] is not None:
+            route.append(parent[route[-1]])
+        return route[::-1]
+
+    def _walk_local(self, shard, u, v):
+        "global idxs from u to v within shard, excluding u"
+        first = self.shard_start[shard]
+        s = self.shard_start[shard + 1] - first
+        next_hop = self.next_hop[shard]
+        u, v = u - first, v - first
+        path = []
+        while u != v:
+            u = next_hop[u * s + v]
+            if u == UNREACHABLE:
+                return None
+            path.append(first + u)
+        return path
+
+    def _walk_exit(self, shard, u, other):
+        "global idxs from u to the first node in the other shard, excluding u"
+        first = self.shard_start[shard]
+        next_exit = self.next_exit[shard][other]
+        u -= first
+        path = []
+        while next_exit[u] != GATEWAY:
+            u = next_exit[u]
+            if u == -2:
+                return None
+            path.append(first + u)
+        path.append(self.gateways[shard][other][u])
+        return path
+
+    def _walk(self, route, s, t):
+        path = [s]
+        for shard, other in zip(route, route[1:]):
+            step = self._walk_exit(shard, path[-1], other)
+            if step is None:
+                return None
+            path.extend(step)
+        step = self._walk_local(route[-1], path[-1], t)
+        if step is None:
+            return None
+        return path + step
+
+    def _search_route(self, route, s, t):
+        "BFS restricted to the shards on route"
+        allowed = set(route)
+        out, shard_of = self.graph.out, self.shard_of
+        parent = {s: None}
+        order = [s]
+        for u in order:
+            if u == t:
+                path = [t]
+                while parent[path[-1]] is not None:
+                    path.append(parent[path[-1]])
+                return path[::-1]
+            for v in out[u]:
+                if v not in parent and shard_of[v] in allowed:
+                    parent[v] = u
+                    order.append(v)
+        return None
+
+    def find_path_idxs(self, s, t):
+        "returns (path, method) with path as node idxs"
+        route = self.shard_route(self.shard_of[s], self.shard_of[t])
+        if not route:
+            return None, None
+        path = self._walk(route, s, t)
+        if path is not None:
+            return path, 'tables'
+        path = self._search_route(route, s, t)
+        if path is not None:
+            return path, 'route'
+        return None, None
+
+    def find_path(self, source, target, value):
+        """
+        path of nodes, None if value exceeds the capacity the tables were
+        built for or no path was found on the shard route
+        """
+        if value > self.min_capacity:
+            return None
+        index = self.graph.index
+        if source not in index or target not in index:
+            return None
+        path, method = self.find_path_idxs(index[source], index[target])
+        if path is None:
+            return None
+        return [self.graph.nodes[i] for i in path]
+
+
+def test_shard_routing(cn, router, num_queries=1000, value=2):
+    from dijkstra_weighted import dijkstra_path
+    import networkx as nx
+    assert value <= router.min_capacity
+    print router
+    nodes = router.graph.nodes
+    cost_func = cn._get_path_cost_function(value)
+    methods = collections.Counter()
+    stretch = []
+    t_shard = t_global = 0.
+    for i in range(num_queries):
+        source, target = random.sample(nodes, 2)
+        start = time.time()
+        path, method = router.find_path_idxs(router.graph.index[source],
+                                             router.graph.index[target])
+        t_shard += time.time() - start
+        start = time.time()
+        try:
+            exact = dijkstra_path(cn.G, source, target, cost_func)
+        except nx.NetworkXNoPath:
+            exact = None
+        t_global += time.time() - start
+        methods[method] += 1
+        if path and exact:
+            stretch.append((len(path) - 1) / float(len(exact) - 1))
+    print "methods", dict(methods)
+    if stretch:
+        print "stretch avg:{:.3f} max:{:.3f} exact:{:.1f}%".format(
+            sum(stretch) / len(stretch), max(stretch),
+            100. * sum(1 for x in stretch if x == 1) / len(stretch))
+    print "shard {:.2f}ms global {:.2f}ms per query, speedup {:.1f}x".format(
+        1000 * t_shard / num_queries, 1000 * t_global / num_queries,
+        t_global / (t_shard or 1e-9))
+
+
+if __name__ == '__main__':
+    from routing_sim import BaseNetworkConfiguration
+    from netbuild import build_network
+    cn = build_network(BaseNetworkConfiguration(10000))
+    value = 2
+    router = ShardRouter(cn, min_capacity=value, processes=multiprocessing.cpu_count())
+    test_shard_routing(cn, router, value=value)
@@ -0,0 +1,199 @@
+"""
+Checkpointed parameter sweeps over BaseNetworkConfiguration.
+
+A grid maps attributes to the values to sweep, either a list or a dict of
+name -> value for values without a readable repr, e.g. WeightedDistributions.
+Attributes of BaseNetworkConfiguration define the network, all others are
+passed to the experiment as keyword arguments. Every point of the cartesian
+product runs in a process pool: first the missing networks are built, one
+task per distinct network, then every point loads its network and runs the
+experiment.
+
+The directory holds
+
+    networks/<key>.pickle   built networks, keyed by configuration and seed only
+    results/<key>.json      finished points, skipped when resuming
+
+Both are written to a temporary file first and then renamed, so a crash
+never leaves a partial checkpoint behind.
+"""
+import cPickle
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from routing_sim import BaseNetworkConfiguration
+from netbuild import build_network
+from netstats import hop_stats
+
+
+def _named(values):
+    if isinstance(values, dict):
+        return sorted(values.items())
+    return [(str(v), v) for v in values]
+
+
+def sweep_points(grid):
+    "[[(attribute, name, value), ...], ...] for all combinations"
+    attributes = sorted(grid)
+    named = [_named(grid[a]) for a in attributes]
+    return [[(a, name, value) for a, (name, value) in zip(attributes, combination)]
+            for combination in itertools.product(*named)]
+
+
+def point_key(point, seed):
+    return ','.join(['{}={}'.format(a, name) for a, name, value in point] +
+                    ['seed={}'.format(seed)])
+
+
+def network_key(point, seed):
+    "key of the network, points only differing in experiment arguments share it"
+    return point_key([p for p in point if hasattr(BaseNetworkConfiguration, p[0])], seed)
+
+
+def make_config(point):
+    "returns the configuration and the keyword arguments for the experiment"
+    values = dict((a, value) for a, name, value in point)
+    config = BaseNetworkConfiguration(values.pop('fn_num_nodes',
+                                                 BaseNetworkConfiguration.fn_num_nodes))
+    experiment_kwargs = dict()
+    for a, value in values.items():
+        if hasattr(config, a):
+            setattr(config, a, value)
+        else:
+            experiment_kwargs[a] = value
+    return config, experiment_kwargs
+
+
+def _dump_atomic(obj, filename, dump):
+    tmp = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp, 'wb') as fh:
+        dump(obj, fh)
+    os.rename(tmp, filename)
+
+
+def load_network(config, seed, filename):
+    "the cached network or build and cache it"
+    if os.path.exists(filename):
+        with open(filename, 'rb') as fh:
+            return cPickle.load(fh)
+    cn = build_network(config, seed, processes=1)
+    _dump_atomic(cn, filename, lambda obj, fh: cPickle.dump(obj, fh, cPickle.HIGHEST_PROTOCOL))
+    return cn
+
+
+def path_experiment(cn, config, values=(2, 100, 1000), num_queries=100, recursive=False):
+    """
+    hop statistics, success rates and path lengths of global routing per value
+    recursive: also run recursive routing, which can take exponential time
+    for values few channels can carry
+    """
+    def mean(l):
+        return sum(l) / float(len(l)) if l else None
+
+    results = dict()
+    for value in values:
+        stats = hop_stats(cn, min_capacity=value, num_sources=num_queries)
+        result = dict(mean_hops=stats.mean_hops, diameter=stats.diameter,
+                      unreachable=stats.unreachable / float(stats.num_pairs + stats.unreachable))
+        global_lengths, recursive_lengths, contacted = [], [], []
+        for i in range(num_queries):
+            source, target = random.sample(cn.nodes, 2)
+            path = cn.find_path_global(source, target, value)
+            if path:
+                global_lengths.append(len(path))
+            if recursive:
+                c, path = cn.find_path_recursively(source, target, value)
+                if path:
+                    recursive_lengths.append(len(path))
+                    contacted.append(c)
+        result.update(global_found=len(global_lengths),
+                      global_mean_length=mean(global_lengths))
+        if recursive:
+            result.update(recursive_found=len(recursive_lengths),
+                          recursive_mean_length=mean(recursive_lengths),
+                          recursive_mean_contacted=mean(contacted))
+        results[value] = result
+    return results
+
+
+def _network_filename(directory, point, seed):
+    return os.path.join(directory, 'networks', network_key(point, seed) + '.pickle')
+
+
+def _build_point_network(args):
+    directory, point, seed = args
+    start = time.time()
+    config, experiment_kwargs = make_config(point)
+    load_network(config, seed, _network_filename(directory, point, seed))
+    return network_key(point, seed), time.time() - start
+
+
+def _run_point(args):
+    directory, point, seed, experiment = args
+    key = point_key(point, seed)
+    start = time.time()
+    config, experiment_kwargs = make_config(point)
+    cn = load_network(config, seed, _network_filename(directory, point, seed))
+    random.seed(seed)
+    result = dict(key=key, point=dict((a, name) for a, name, value in point), seed=seed,
+                  result=experiment(cn, config, **experiment_kwargs))
+    result['elapsed'] = time.time() - start
+    _dump_atomic(result, os.path.join(directory, 'results', key + '.json'), json.dump)
+    return key, result['elapsed']
+
+
+def run_sweep(directory, grid, experiment=path_experiment, seed=43, processes=None):
+    """
+    runs all points of grid not yet finished in directory
+    experiment(cn, config, **kwargs) must be a module level function returning json data
+    """
+    for sub in ('networks', 'results'):
+        if not os.path.exists(os.path.join(directory, sub)):
+            os.makedirs(os.path.join(directory, sub))
+    points = sweep_points(grid)
+    todo = [p for p in points if not os.path.exists(
+        os.path.join(directory, 'results', point_key(p, seed) + '.json'))]
+    print "{} points, {} done, {} to run".format(len(points), len(points) - len(todo), len(todo))
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    # build each missing network once, points sharing it would build it concurrently
+    missing = dict()
+    for p in todo:
+        if not os.path.exists(_network_filename(directory, p, seed)):
+            missing.setdefault(network_key(p, seed), p)
+    args = [(directory, p, seed) for key, p in sorted(missing.items())]
+    for i, (key, elapsed) in enumerate(pool.imap_unordered(_build_point_network, args)):
+        print "network {}/{} {} {:.1f}s".format(i + 1, len(args), key, elapsed)
+    args = [(directory, p, seed, experiment) for p in todo]
+    for i, (key, elapsed) in enumerate(pool.imap_unordered(_run_point, args)):
+        print "{}/{} {} {:.1f}s".format(i + 1, len(todo), key, elapsed)
+    pool.close()
+    pool.join()
+    return load_results(directory)
+
+
+def load_results(directory):
+    results = []
+    path = os.path.join(directory, 'results')
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith('.json'):
+            with open(os.path.join(path, filename)) as fh:
+                results.append(json.load(fh))
+    return results
+
+
+if __name__ == '__main__':
+    from utils import WeightedDistribution
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'sweep'
+    grid = dict(
+        fn_num_nodes=[1000, 10000],
+        fn_deposit_dist=dict(default=BaseNetworkConfiguration.fn_deposit_dist,
+                             flat=WeightedDistribution(10, weighted_values=[(1000, 100)])),
+        fn_num_channel_dist=dict(default=BaseNetworkConfiguration.fn_num_channel_dist,
+                                 few=WeightedDistribution(2, weighted_values=[(5, 100)])),
+    )
+    for r in run_sweep(directory, grid):
+        print r['key'], json.dumps(r['result'], sort_keys=True)
@@ -35,8 +35,8 @@ class WeightedDistribution(object):
             val = minval + part * value_range
             return val
 
-    def random(self):
-        return self.get_value(random.random())
+    def random(self, rng=random):
+        return self.get_value(rng.random())
 
     def smoothen(self, num=1):
         """
@@ -174,6 +174,19 @@ def draw(cn, path=None):
     raw_input('press any key')
 
 
+def draw_load(cn, channel_load):
+    "colors channels by load, channel_load: {(a, b): load}"
+    plt.clf()
+    pos = calc_postions(cn)
+    nx.draw_networkx_nodes(cn.G, pos, node_size=1)
+    edgelist = sorted(channel_load, key=channel_load.get)  # busiest drawn on top
+    nx.draw_networkx_edges(cn.G, pos, edgelist=edgelist,
+                           edge_color=[channel_load[e] for e in edgelist],
+                           edge_cmap=plt.cm.Reds)
+    plt.show()
+    raw_input('press any key')
+
+
 def draw3d(cn):
     from doplotly import draw
     node_coords, edges = calc3d_positions(cn)